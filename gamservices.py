@@ -14,25 +14,41 @@ Usage example:
 
 Notes:
 - `fetch_report_url` is decorated with `retry` from `retry_logic` to retry on failures.
-- The caller is responsible for downloading the CSV from the returned URL.
+- `fetch_report_df` downloads the CSV through `report_download`, which spools
+  it to a temporary file with resume and integrity checks.
 """
 
+import copy
+import hashlib
 import json
 import locale
 import logging
+import os
+import re
 import tempfile
 import time
-from typing import Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
 
 from googleads import ad_manager
 import pandas as pd
+from zeep.helpers import serialize_object
 
 from retry_logic import retry
+from report_download import download_report, read_report_csv
+from report_job_registry import ReportJobRegistry
+from shared_report import write_shared_report
 
 logger = logging.getLogger(__name__)
 
 locale.getdefaultlocale = lambda *args: ["en_US", "UTF-8"]
 
+# Max IDs inlined into one shard's `IN (...)` filter; more IDs mean more shards.
+MAX_IDS_PER_SHARD = 400
+# Report dimensions that have a matching column in the PQL `Line_Item` table.
+LINE_ITEM_PQL_COLUMNS = {"LINE_ITEM_ID": "Id", "ORDER_ID": "OrderId"}
+PQL_KEYWORDS = {"AND", "OR", "NOT", "IN", "IS", "NULL", "LIKE"}
+
 
 class GAMReportClient:
     """Client for running GAM saved report queries and retrieving results.
@@ -40,13 +56,19 @@ class GAMReportClient:
     Args:
         ad_manager_client: An authenticated `googleads.ad_manager.AdManagerClient`.
         version: API version string (default "v202508").
+        job_registry: Optional `ReportJobRegistry`; when set, `run_report`
+            attaches to an identical in-flight job instead of submitting.
     """
 
     def __init__(
-        self, ad_manager_client: ad_manager.AdManagerClient, version: str = "v202508"
+        self,
+        ad_manager_client: ad_manager.AdManagerClient,
+        version: str = "v202508",
+        job_registry: Optional[ReportJobRegistry] = None,
     ) -> None:
         self.version = version
         self.ad_manager_client = ad_manager_client
+        self.job_registry = job_registry
 
         # Initialize appropriate service.
         self.report_service = self.ad_manager_client.GetService(
@@ -108,6 +130,7 @@ class GAMReportClient:
         network_code: str,
         service_account_dict: dict,
         version: str = "v202508",
+        job_registry: Optional[ReportJobRegistry] = None,
     ):
         """Create a `GAMReportClient` using service account credentials.
 
@@ -119,6 +142,7 @@ class GAMReportClient:
                 network_code: The network code to target.
                 service_account_dict: Dict for the service account.
                 version: API version string to use for services.
+                job_registry: Optional registry used to share in-flight report jobs.
 
         Returns:
                 An initialized `GAMReportClient` instance.
@@ -138,7 +162,7 @@ class GAMReportClient:
             logger.info(yaml_string)
             ad_manager_client = ad_manager.AdManagerClient.LoadFromString(yaml_string)
 
-        return cls(ad_manager_client, version)
+        return cls(ad_manager_client, version, job_registry)
 
     def check_all_networks(self):
         """Print basic information about the current authenticated network.
@@ -219,9 +243,21 @@ class GAMReportClient:
 
         return response["results"][0]
 
+    @staticmethod
+    def report_query_hash(report_query: Any) -> str:
+        """Return a stable hash identifying a report query."""
+        query_json = json.dumps(
+            serialize_object(report_query, dict), sort_keys=True, default=str
+        )
+        return hashlib.sha256(query_json.encode("utf-8")).hexdigest()
+
     def run_report(self, saved_query: Any):
         """Start a report job using a saved query definition.
 
+        With a `job_registry`, an identical job another process submitted
+        and that is still `IN_PROGRESS` is reused instead of submitting a new
+        one. Finished jobs are never reused, so a rerun always gets fresh data.
+
         Args:
             saved_query: A saved query object (as returned by `get_saved_query`).
 
@@ -232,9 +268,17 @@ class GAMReportClient:
 
         report_job["reportQuery"] = saved_query["reportQuery"]
 
-        report_job_response = self.report_service.runReportJob(report_job)
+        if self.job_registry is None:
+            return self.report_service.runReportJob(report_job)
 
-        return report_job_response
+        job_id = self.job_registry.get_or_submit(
+            self.report_query_hash(report_job["reportQuery"]),
+            lambda: self.report_service.runReportJob(report_job)["id"],
+            is_in_flight=lambda job_id: (
+                self.report_service.getReportJobStatus(job_id) == "IN_PROGRESS"
+            ),
+        )
+        return {"id": job_id}
 
     @retry(retries=3, delay=5)
     def fetch_report_url(self, report_job_id: int, wait_for: int = 30):
@@ -263,6 +307,10 @@ class GAMReportClient:
             if status == "IN_PROGRESS":
                 time.sleep(wait_for)  # Wait 30 seconds before checking again
 
+        # The job is no longer in flight, so later runs must not attach to it
+        if self.job_registry is not None:
+            self.job_registry.discard(report_job_id)
+
         # Download the report if it is completed
         if status == "COMPLETED":
             download_url = self.report_service.getReportDownloadUrlWithOptions(
@@ -273,15 +321,9 @@ class GAMReportClient:
         else:
             logger.info(f"{report_job_id} Report job failed.")
 
-    def fetch_report_df(self, report_job_id: int):
-        report_download_url = self.fetch_report_url(report_job_id)
-        logger.info(report_download_url)
-        delivery_df = pd.read_csv(
-            report_download_url,  # type: ignore
-            compression="gzip",
-            low_memory=False,
-        )
-
+    @staticmethod
+    def normalize_columns(delivery_df: pd.DataFrame) -> pd.DataFrame:
+        """Rename report columns like `Dimension.LINE_ITEM_ID` to `line_item_id`."""
         renamed_dict = {
             i: i.replace(" ", "_")
             .replace("[", "_")
@@ -293,3 +335,210 @@ class GAMReportClient:
         delivery_df.rename(columns=renamed_dict, inplace=True)
 
         return delivery_df
+
+    def fetch_report_df(self, report_job_id: int, share_path: Optional[str] = None):
+        """Download a finished report job into a DataFrame with normalized columns.
+
+        Args:
+            report_job_id: The numeric report job id returned by `runReportJob`.
+            share_path: Optional path to also write the result to as an Arrow
+                IPC file, for sibling checks to read with `shared_report`.
+
+        Returns:
+            The report DataFrame.
+        """
+        report_download_url = self.fetch_report_url(report_job_id)
+        logger.info(report_download_url)
+        if report_download_url is None:
+            raise RuntimeError(f"Report job {report_job_id} did not complete")
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            spool_path = os.path.join(temp_dir, f"report_{report_job_id}.csv.gz")
+            download_report(report_download_url, spool_path)
+            delivery_df = read_report_csv(spool_path)
+
+        delivery_df = self.normalize_columns(delivery_df)
+        if share_path:
+            write_shared_report(delivery_df, share_path)
+
+        return delivery_df
+
+    @staticmethod
+    def line_item_filter(report_query: Any) -> Optional[tuple[str, list]]:
+        """Translate a report query's statement into a PQL `Line_Item` condition.
+
+        Only statements filtering on nothing but `LINE_ITEM_ID` and `ORDER_ID`
+        can be translated; anything else is left to the report itself.
+
+        Args:
+            report_query: The `reportQuery` of a saved query.
+
+        Returns:
+            A `(condition, values)` pair, or None if there is no usable filter.
+        """
+        statement = report_query["statement"]
+        query = (statement["query"] if statement else None) or ""
+        where = re.sub(r"^\s*WHERE\s+", "", query, flags=re.IGNORECASE).strip()
+        if not where:
+            return None
+
+        # Ignore string literals and bind variables when looking for column names.
+        bare = re.sub(r"'[^']*'|:\w+", "", where)
+        identifiers = {word.upper() for word in re.findall(r"\b[A-Za-z_]\w*", bare)}
+        if not identifiers <= set(LINE_ITEM_PQL_COLUMNS) | PQL_KEYWORDS:
+            logger.debug("Saved query filter not usable for line item lookup: %s", where)
+            return None
+
+        condition = re.sub(
+            r"\b(LINE_ITEM_ID|ORDER_ID)\b",
+            lambda match: LINE_ITEM_PQL_COLUMNS[match.group(1).upper()],
+            where,
+            flags=re.IGNORECASE,
+        )
+        return condition, list(statement["values"] or [])
+
+    def get_line_item_ids(
+        self,
+        where: Optional[str] = None,
+        bind_variables: Optional[dict] = None,
+        report_query: Any = None,
+    ) -> list[int]:
+        """Return the IDs of all line items matching a PQL `where` clause.
+
+        Only the `Id` column is selected through the PQL service, so no full
+        line item entities are transferred.
+
+        Args:
+            where: Optional condition on `Line_Item` columns, e.g.
+                "EndDateTime >= :today_start".
+            bind_variables: Values for the bind variables used in `where`.
+            report_query: Optional `reportQuery` whose order / line item filter
+                is ANDed on (see `line_item_filter`), so no empty shards are run.
+
+        Returns:
+            A list of line item IDs.
+        """
+        conditions = [f"({where})"] if where else []
+        values = ad_manager.PQLHelper.GetQueryValuesFromDict(
+            bind_variables or {}, self.version
+        )
+        report_filter = self.line_item_filter(report_query) if report_query else None
+        if report_filter:
+            conditions.append(f"({report_filter[0]})")
+            values += report_filter[1]
+
+        query = "SELECT Id FROM Line_Item"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+
+        data_downloader = self.ad_manager_client.GetDataDownloader(version=self.version)
+        rows = data_downloader.DownloadPqlResultToList(query, values)
+        # The first row is the header.
+        line_item_ids = [int(row[0]) for row in rows[1:]]
+
+        logger.info("Found %d line items for sharding", len(line_item_ids))
+        return line_item_ids
+
+    @staticmethod
+    def shard_report_query(
+        report_query: Any, dimension: str, ids: list[int], shard_count: int
+    ) -> list[Any]:
+        """Split a report query into copies filtered on disjoint ID ranges.
+
+        The ID filter is ANDed onto the saved query's existing statement, so
+        every row of the original report lands in exactly one shard.
+
+        Args:
+            report_query: The `reportQuery` of a saved query.
+            dimension: Filterable ID dimension, e.g. "LINE_ITEM_ID" or "ORDER_ID".
+            ids: All IDs the report should cover.
+            shard_count: Minimum number of shards to split `ids` into. More
+                are used if needed to keep each shard within `MAX_IDS_PER_SHARD`.
+
+        Returns:
+            A list of report queries, one per non-empty shard.
+        """
+        ids = sorted(set(ids))
+        shard_size = min(-(-len(ids) // shard_count), MAX_IDS_PER_SHARD) if ids else 0
+        statement = report_query["statement"]
+        existing_query = (statement["query"] if statement else None) or ""
+        existing_values = (statement["values"] if statement else None) or []
+        existing_where = re.sub(r"^\s*WHERE\s+", "", existing_query, flags=re.IGNORECASE)
+
+        shard_queries = []
+        for start in range(0, len(ids), shard_size or 1):
+            id_list = ", ".join(str(i) for i in ids[start : start + shard_size])
+            where = f"{dimension} IN ({id_list})"
+            if existing_where:
+                where = f"({existing_where}) AND {where}"
+
+            shard_query = copy.deepcopy(report_query)
+            shard_query["statement"] = {"query": f"WHERE {where}", "values": existing_values}
+            shard_queries.append(shard_query)
+
+        return shard_queries
+
+    def _run_shard_df(self, report_query: Any) -> pd.DataFrame:
+        # A separate client per shard: googleads services are not thread safe.
+        shard_client = GAMReportClient(
+            self.ad_manager_client, self.version, self.job_registry
+        )
+        report_job = shard_client.run_report({"reportQuery": report_query})
+        report_job_id = report_job["id"]
+        logger.info("Shard report job submitted: job_id=%s", report_job_id)
+
+        return shard_client.fetch_report_df(report_job_id)
+
+    def fetch_sharded_report_df(
+        self,
+        saved_query: Any,
+        dimension: str,
+        ids: list[int],
+        shard_count: int = 4,
+        max_workers: Optional[int] = None,
+        share_path: Optional[str] = None,
+    ) -> pd.DataFrame:
+        """Run a saved query as parallel sharded report jobs and merge the results.
+
+        Each shard is submitted, polled, downloaded and parsed concurrently,
+        then the shards are concatenated into one DataFrame with the same
+        normalized columns as `fetch_report_df`.
+
+        Sharding is by ID filter only: splitting by date range would return
+        one row per shard for the same dimensions, and metrics such as video
+        length cannot be summed back together.
+
+        Args:
+            saved_query: A saved query object (as returned by `get_saved_query`).
+            dimension: Filterable ID dimension, e.g. "LINE_ITEM_ID" or "ORDER_ID".
+            ids: All IDs the report should cover.
+            shard_count: Minimum number of report jobs to split the query into.
+            max_workers: Max concurrent shards (defaults to `shard_count`).
+            share_path: Optional path to also write the merged result to as an
+                Arrow IPC file (see `fetch_report_df`). The result only covers
+                `ids`, so this should not be the path used for the full query.
+
+        Returns:
+            The merged report DataFrame.
+        """
+        shard_queries = self.shard_report_query(
+            saved_query["reportQuery"], dimension, ids, shard_count
+        )
+        if not shard_queries:
+            logger.info("No IDs to shard on; running the saved query unsharded")
+            report_job = self.run_report(saved_query)
+            return self.fetch_report_df(report_job["id"], share_path)
+
+        logger.info("Running saved query as %d shards by %s", len(shard_queries), dimension)
+        with ThreadPoolExecutor(max_workers=max_workers or shard_count) as executor:
+            shard_dfs = list(executor.map(self._run_shard_df, shard_queries))
+
+        columns = shard_dfs[0].columns
+        delivery_df = pd.concat(
+            [shard_df.reindex(columns=columns) for shard_df in shard_dfs],
+            ignore_index=True,
+        )
+        if share_path:
+            write_shared_report(delivery_df, share_path)
+
+        return delivery_df
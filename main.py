@@ -19,6 +19,7 @@ import json
 import time
 import os
 import re
+import tempfile
 from pathlib import Path
 
 import pandas as pd
@@ -26,13 +27,28 @@ import boto3
 import awswrangler as wr
 
 from gamservices import GAMReportClient
+from report_job_registry import ReportJobRegistry
+from pql_report import PQLReportClient
+from shared_report import read_shared_report
+from run_profiler import RunProfiler
 from utils import setup_logging, get_env
-from slack_msg_build import outer_user_block, outer_user_text_block, inner_info_block
-from slack_notification import slack_notification, SlackAPI
+from slack_msg_build import outer_user_block, outer_user_text_block, inner_info_block, resolved_info_block
+from slack_notification import SlackAPI
+from notification_queue import NotificationQueue, NotificationWorker
+from violation_snapshot import (
+    KEY_COLUMNS,
+    add_row_hash,
+    load_snapshot,
+    save_snapshot,
+    evaluate_incremental,
+    apply_end_gate,
+    build_snapshot,
+    diff_violations,
+)
 
 logger = logging.getLogger(__name__)
 
-def main():
+def main(notification_queue: NotificationQueue, profiler: RunProfiler):
     application_name = get_env("APPLICATION_NAME")
     network_code = get_env("NETWORK_CODE")
     service_account_json = get_env("SERVICE_ACCOUNT_JSON")
@@ -49,6 +65,7 @@ def main():
     SLACK_RATE_LIMIT_DELAY = 2 
     DEAL_ID = 0
 
+    run_started_at = time.time()
     logger.info(
         "Starting skip_not_enabled-check main: report_id=%s",
         google_ads_report_id,
@@ -56,9 +73,14 @@ def main():
 
     today_date = datetime.now(pytz.timezone("America/New_York"))
     today_date_str = today_date.date().strftime("%Y-%m-%d")
+    # The end gate compares UTC end dates with today's date, so a line item that
+    # ended earlier today can still violate; pre-filters must not cut it off
+    today_start_utc = pytz.utc.localize(datetime.combine(today_date.date(), datetime.min.time()))
     print(today_date)
     s3_dataset_path = aws_skip_check_bucket.rstrip("/") + f"/skip_not_enabled/date={today_date_str}.csv"
     logger.debug("S3 state file path resolved: %s", s3_dataset_path)
+    s3_snapshot_path = aws_skip_check_bucket.rstrip("/") + "/skip_not_enabled/snapshot.csv"
+    s3_resolved_path = aws_skip_check_bucket.rstrip("/") + f"/skip_not_enabled/resolved/date={today_date_str}.csv"
 
     # Parse service account JSON
     service_account_dict = json.loads(service_account_json)
@@ -68,6 +90,13 @@ def main():
         application_name=application_name,
         network_code=network_code,
         service_account_dict=service_account_dict,
+        # Overlapping runs attach to the same in-flight report job
+        job_registry=ReportJobRegistry(
+            os.getenv(
+                "REPORT_JOB_REGISTRY_DIR",
+                os.path.join(tempfile.gettempdir(), "gam-report-jobs"),
+            )
+        ),
     )
     client.check_client_service()
     logger.info("GAM client verified and ready to work....")
@@ -77,14 +106,75 @@ def main():
     logger.debug("reportQuery value: %s", report.reportQuery)
 
 
-    logger.debug("Submitting report job to GAM API")
-    report_job = client.run_report(report)
-    report_job_id = report_job["id"]
-    logger.info("Report job submitted: job_id=%s", report_job_id)
+    with profiler.stage("fetch_report_df"):
+        report_shards = int(os.getenv("REPORT_SHARDS", "1"))
+        shared_report_dir = os.getenv("SHARED_REPORT_DIR")
+        share_path = (
+            os.path.join(shared_report_dir, f"report_{google_ads_report_id}.arrow")
+            if shared_report_dir
+            else None
+        )
+        # Sharded results only cover live line items, so they must not be shared
+        # under the name siblings use for the full saved query
+        live_share_path = (
+            os.path.join(
+                shared_report_dir,
+                f"report_{google_ads_report_id}.ending_from_{today_date_str}.arrow",
+            )
+            if shared_report_dir
+            else None
+        )
+
+        delivery_df = None
+        if os.getenv("SKIP_CHECK_SOURCE", "report") == "pql":
+            # Paged entity queries instead of waiting in GAM's report queue
+            pql_client = PQLReportClient(
+                client.ad_manager_client,
+                client.version,
+                cache_dir=os.getenv(
+                    "GAM_ENTITY_CACHE_DIR",
+                    os.path.join(tempfile.gettempdir(), "gam-entity-cache"),
+                ),
+            )
+            delivery_df = pql_client.fetch_skip_check_df(today_start_utc)
+        elif share_path:
+            # A sibling check running alongside this one may already have fetched
+            # the report; never reuse one from an earlier run, it may predate fixes
+            shared_paths = [share_path] + ([live_share_path] if report_shards > 1 else [])
+            for path in shared_paths:
+                delivery_df = read_shared_report(
+                    path,
+                    max_age=int(os.getenv("SHARED_REPORT_MAX_AGE", "120")),
+                    written_after=run_started_at,
+                )
+                if delivery_df is not None:
+                    break
+
+        if delivery_df is None and report_shards > 1:
+            # Ended line items can never violate the rule, so only live ones are sharded
+            line_item_ids = client.get_line_item_ids(
+                "EndDateTime >= :today_start",
+                {"today_start": today_start_utc},
+                report["reportQuery"],
+            )
+            delivery_df = client.fetch_sharded_report_df(
+                report,
+                "LINE_ITEM_ID",
+                line_item_ids,
+                shard_count=report_shards,
+                share_path=live_share_path,
+            )
+        elif delivery_df is None:
+            logger.debug("Submitting report job to GAM API")
+            report_job = client.run_report(report)
+            report_job_id = report_job["id"]
+            logger.info("Report job submitted: job_id=%s", report_job_id)
 
-    delivery_df = client.fetch_report_df(report_job_id)
+            delivery_df = client.fetch_report_df(report_job_id, share_path)
     delivery_df.to_csv("metadata.csv")
-    
+    # Hash the raw report values before any coercion so hashes are stable across runs
+    add_row_hash(delivery_df, list(delivery_df.columns))
+    previous_snapshot_df = load_snapshot(s3_snapshot_path, boto3_session)
 
     # Core logic
     delivery_df["video_viewership_video_length"] = pd.to_numeric(
@@ -111,14 +201,73 @@ def main():
     print(Today_date_only)
 
 
+    def is_rule_violation(df: pd.DataFrame) -> pd.Series:
+        return (
+            (df["video_viewership_video_length"] >= VIDEO_LENGTH_THRESHOLD) &
+            (df["video_viewership_skip_button_shown"] == VIDEO_VIEWERSSIP_SKIP_BUTTON_SHOWN) &
+            (df["creative_size"] == REQUIRED_CREATIVE_SIZE) &
+            (df["programmatic_deal_id"] == DEAL_ID)
+        )
+
+    with profiler.stage("rule_filter"):
+        # Only rows whose content changed since the last run are re-evaluated
+        evaluate_incremental(delivery_df, previous_snapshot_df, is_rule_violation)
+        # The end date gate depends on today's date, not on the row, so it is
+        # applied every run on top of the cached rule result
+        apply_end_gate(
+            delivery_df,
+            ~(delivery_df["line_item_creative_end_date"] >= Today_date_only),
+        )
+
+    current_snapshot_df = build_snapshot(delivery_df)
+    violation_diff = diff_violations(previous_snapshot_df, current_snapshot_df)
+    logger.info(
+        "Violation diff: new=%d, persisting=%d, resolved=%d",
+        len(violation_diff["new"]),
+        len(violation_diff["persisting"]),
+        len(violation_diff["resolved"]),
+    )
+    save_snapshot(current_snapshot_df, s3_snapshot_path, boto3_session)
+
+    if violation_diff["resolved"]:
+        # Overlapping runs diff against the same snapshot, so only report keys
+        # no run has reported as resolved today
+        try:
+            posted_resolved_df = wr.s3.read_csv(s3_resolved_path, boto3_session=boto3_session, dtype=str)
+        except Exception as e:
+            logger.info("No resolved keys recorded for date=%s (%s)", today_date_str, str(e))
+            posted_resolved_df = pd.DataFrame(columns=KEY_COLUMNS)
+        posted_resolved_keys = set(zip(*(
+            posted_resolved_df[col].astype(str).str.strip().str.lower() for col in KEY_COLUMNS
+        )))
+        unposted_resolved = violation_diff["resolved"] - posted_resolved_keys
+
+        delivery_keys = pd.Series(list(zip(*(
+            delivery_df[col].astype(str).str.strip().str.lower() for col in KEY_COLUMNS
+        ))), index=delivery_df.index)
+        resolved_df = delivery_df[delivery_keys.isin(unposted_resolved)]
+        resolved_df = resolved_df.drop_duplicates(subset=KEY_COLUMNS)
+        if resolved_df.empty:
+            logger.info("Resolved violations were already reported today")
+        else:
+            # Record the keys before queueing so a concurrent run sees them as soon as possible
+            wr.s3.to_csv(
+                df=pd.DataFrame(
+                    sorted(posted_resolved_keys | unposted_resolved), columns=KEY_COLUMNS
+                ),
+                path=s3_resolved_path,
+                index=False,
+                boto3_session=boto3_session,
+            )
+            resolved_msg = {"blocks": [
+                {"type": "header", "text": {"type": "plain_text", "text": " Skip not enabled violations resolved "}},
+                {"type": "rich_text", "elements": [resolved_info_block(resolved_df)]},
+            ]}
+            notification_queue.enqueue(slack_webhook, resolved_msg)
+            logger.info("Resolved summary queued for %d line items", len(resolved_df))
+
     # Filter for active assets only
-    rule_violation = delivery_df[
-        (delivery_df["video_viewership_video_length"] >= VIDEO_LENGTH_THRESHOLD) &
-        (delivery_df["video_viewership_skip_button_shown"] == VIDEO_VIEWERSSIP_SKIP_BUTTON_SHOWN) &
-        (delivery_df["creative_size"] == REQUIRED_CREATIVE_SIZE) &
-        (delivery_df["programmatic_deal_id"] == DEAL_ID) &
-        (delivery_df["line_item_creative_end_date"] >= Today_date_only)  
-    ]
+    rule_violation = delivery_df[delivery_df["is_violation"]]
     rule_violation.to_csv("Rulevoilation.csv")
     if rule_violation.empty:
         logger.info("No violations found")
@@ -127,69 +276,70 @@ def main():
     final_df = rule_violation.copy()
     logger.info("Violation found")
 
-    # Track previously alerted line items
-    sent_keys_list = []
+    with profiler.stage("state_merge"):
+        # Track previously alerted line items
+        sent_keys_list = []
 
-    try:
-        sent_keys_df = wr.s3.read_csv(s3_dataset_path, boto3_session=boto3_session)
-        if sent_keys_df.empty:
-            logger.info("S3 dataset exists but no records for date=%s", today_date_str)
+        try:
+            sent_keys_df = wr.s3.read_csv(s3_dataset_path, boto3_session=boto3_session)
+            if sent_keys_df.empty:
+                logger.info("S3 dataset exists but no records for date=%s", today_date_str)
+                sent_keys_list = []
+            elif "creative_name" in sent_keys_df.columns:
+                sent_keys_list = list(set(
+                    zip(
+                        sent_keys_df["line_item_id"].astype(str),
+                        sent_keys_df["creative_name"].astype(str),
+                        sent_keys_df["creative_size"].astype(str)
+                    )
+                ))
+                logger.info("Loaded %d previously alerted keys (creative_name)", len(sent_keys_list))
+        except Exception as e:
+            logger.info(
+                "No existing S3 dataset/partition found for date=%s (%s)",
+                today_date_str,
+                str(e)
+            )
+            sent_keys_df = pd.DataFrame(
+                columns=["line_item_id", "creative_name", "creative_size"]
+            )
             sent_keys_list = []
-        elif "creative_name" in sent_keys_df.columns:
-            sent_keys_list = list(set(
-                zip(
-                    sent_keys_df["line_item_id"].astype(str),
-                    sent_keys_df["creative_name"].astype(str),
-                    sent_keys_df["creative_size"].astype(str)
-                )
-            ))
-            logger.info("Loaded %d previously alerted keys (creative_name)", len(sent_keys_list))
-    except Exception as e:
-        logger.info(
-            "No existing S3 dataset/partition found for date=%s (%s)",
-            today_date_str,
-            str(e)
-        )
-        sent_keys_df = pd.DataFrame(
-            columns=["line_item_id", "creative_name", "creative_size"]
-        )
-        sent_keys_list = []
 
-    # Create key tuple for each violation
-    final_df["key_tuple"] = list(zip(
-        final_df["line_item_id"].astype(str),
-        final_df["creative_name"].astype(str),
-        final_df["creative_size"].astype(str)
-    ))
-    final_df["previous_alert_status"] = final_df["key_tuple"].isin(sent_keys_list)
-
-    # DataFrame to append to S3
-    all_violation_keys = pd.DataFrame({
-    'line_item_id': final_df['line_item_id'].astype(str),
-    'creative_name': final_df['creative_name'].astype(str),
-    'creative_size': final_df['creative_size'].astype(str)
-    })
-
-    merged_state_df = pd.concat([sent_keys_df, all_violation_keys], ignore_index=True)
-
-    # Clean columns
-    for col in ['line_item_id', 'creative_name', 'creative_size']:
-        merged_state_df[col] = merged_state_df[col].astype(str).str.strip().str.lower()
-
-    # Drop duplicates by key
-    merged_state_df.drop_duplicates(
-        subset=['line_item_id', 'creative_name', 'creative_size'],
-        keep='first',
-        inplace=True
-    )
+        # Create key tuple for each violation
+        final_df["key_tuple"] = list(zip(
+            final_df["line_item_id"].astype(str),
+            final_df["creative_name"].astype(str),
+            final_df["creative_size"].astype(str)
+        ))
+        final_df["previous_alert_status"] = final_df["key_tuple"].isin(sent_keys_list)
+
+        # DataFrame to append to S3
+        all_violation_keys = pd.DataFrame({
+        'line_item_id': final_df['line_item_id'].astype(str),
+        'creative_name': final_df['creative_name'].astype(str),
+        'creative_size': final_df['creative_size'].astype(str)
+        })
+
+        merged_state_df = pd.concat([sent_keys_df, all_violation_keys], ignore_index=True)
+
+        # Clean columns
+        for col in ['line_item_id', 'creative_name', 'creative_size']:
+            merged_state_df[col] = merged_state_df[col].astype(str).str.strip().str.lower()
+
+        # Drop duplicates by key
+        merged_state_df.drop_duplicates(
+            subset=['line_item_id', 'creative_name', 'creative_size'],
+            keep='first',
+            inplace=True
+        )
 
-    # Save back to S3
-    wr.s3.to_csv(
-        df=merged_state_df,
-        path=s3_dataset_path,
-        index=False,
-        boto3_session=boto3_session
-    )
+        # Save back to S3
+        wr.s3.to_csv(
+            df=merged_state_df,
+            path=s3_dataset_path,
+            index=False,
+            boto3_session=boto3_session
+        )
 
     # Filter for NEW alerts
     new_alerts_df = final_df[~final_df["previous_alert_status"]].copy(deep=True)
@@ -197,87 +347,117 @@ def main():
         logger.info("No NEW alerts (all were previously alerted)")
         return
 
-    # Build Slack blocks
-    elements = []
-    order_group_df = new_alerts_df.groupby(["order_trafficker"])
-    for i, grouped_df in order_group_df:
-        user_email_raw: str = i[0]
-        # The saved format is expected to include the email in parentheses (e.g., "Name (email)").
-        # We defensively parse this and fall back to the raw string if format differs.
-        # Regex pattern to extract email
-        pattern = r"\(([^)]+)\)"
-
-        # Search for the email using the pattern
-        match = re.search(pattern, user_email_raw)
-        if match:
-            user_email = match.group(1)
-        else:
-            user_email = user_email_raw
-            logger.debug(
-                f"Unexpected line_item_trafficker format; using raw value: {user_email_raw}"
-            )
+    with profiler.stage("block_building"):
+        # Build Slack blocks
+        elements = []
+        order_group_df = new_alerts_df.groupby(["order_trafficker"])
+        for i, grouped_df in order_group_df:
+            user_email_raw: str = i[0]
+            # The saved format is expected to include the email in parentheses (e.g., "Name (email)").
+            # We defensively parse this and fall back to the raw string if format differs.
+            # Regex pattern to extract email
+            pattern = r"\(([^)]+)\)"
+
+            # Search for the email using the pattern
+            match = re.search(pattern, user_email_raw)
+            if match:
+                user_email = match.group(1)
+            else:
+                user_email = user_email_raw
+                logger.debug(
+                    f"Unexpected line_item_trafficker format; using raw value: {user_email_raw}"
+                )
 
-        user_id = slack_api.lookup_by_email(user_email)
-        if user_id:
-            elements.append(outer_user_block(user_id))
-        else:
-            logger.warning("Slack user not found for email %s, using email in message", user_email)
-            elements.append(outer_user_text_block(user_email))
-
-        elements.append(inner_info_block(grouped_df))
-        elements.append({"type": "rich_text_section", "elements": [{"type": "text", "text": "\n"}]})
-        time.sleep(SLACK_RATE_LIMIT_DELAY)  # rate limit
-
-    blocks = [
-        {"type": "header", "text": {"type": "plain_text", "text": " Creative size Skip not enabled alert "}},
-        {"type": "section", "text": {"type": "plain_text",
-            "text": "The following line items require immediate attention due to a skip not enabled for creative video duration >= 30 sec:"}},
-        {"type": "divider"},
-        {"type": "rich_text", "elements": elements},
-    ]
-    json_msg = {"blocks": blocks}
+            user_id = slack_api.lookup_by_email(user_email)
+            if user_id:
+                elements.append(outer_user_block(user_id))
+            else:
+                logger.warning("Slack user not found for email %s, using email in message", user_email)
+                elements.append(outer_user_text_block(user_email))
 
-    try:
-        slack_notification(slack_webhook, json_msg)
-        logger.info("Slack notification sent successfully")
-    except Exception as e:
-        logger.exception("Failed to send Slack notification")
+            elements.append(inner_info_block(grouped_df))
+            elements.append({"type": "rich_text_section", "elements": [{"type": "text", "text": "\n"}]})
+            time.sleep(SLACK_RATE_LIMIT_DELAY)  # rate limit
+
+        blocks = [
+            {"type": "header", "text": {"type": "plain_text", "text": " Creative size Skip not enabled alert "}},
+            {"type": "section", "text": {"type": "plain_text",
+                "text": "The following line items require immediate attention due to a skip not enabled for creative video duration >= 30 sec:"}},
+            {"type": "divider"},
+            {"type": "rich_text", "elements": elements},
+        ]
+        json_msg = {"blocks": blocks}
+
+    # Delivered by the background worker; the check does not wait on Slack
+    notification_queue.enqueue(slack_webhook, json_msg)
 
 
 if __name__ == "__main__":
+    import argparse
     import os
     import awswrangler as wr
-    from slack_notification import simple_slack_notification
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Write cProfile and tracemalloc artifacts per stage (or set PROFILE_RUN=1)",
+    )
+    args = parser.parse_args()
 
     aws_profile = get_env("AWS_PROFILE")
     boto3_session = boto3.Session(profile_name=aws_profile)
     status_slack_webhook = get_env("STATUS_SLACK_WEBHOOK")
-    simple_slack_notification(status_slack_webhook, "Skip_enabled-errors-alert Started!")
+    script_dir = Path(__file__).parent
+    notification_queue = NotificationQueue(
+        os.getenv("NOTIFICATION_QUEUE_DB", str(script_dir / "notification_queue.db"))
+    )
+    notification_worker = NotificationWorker(notification_queue)
+
+    profiler = None
 
     try:
         setup_logging()
-        main()
+        # Started after logging is configured so delivery results reach the uploaded log
+        notification_worker.start()
+        notification_queue.enqueue_text(status_slack_webhook, "Skip_enabled-errors-alert Started!")
+        # Built after logging is configured so its messages reach the uploaded log
+        profile_enabled = args.profile or os.getenv("PROFILE_RUN", "").lower() in ("1", "true")
+        profiler = RunProfiler(
+            tempfile.mkdtemp(prefix="skip-check-profile-") if profile_enabled else "",
+            enabled=profile_enabled,
+        )
+        main(notification_queue, profiler)
     except Exception as e:
         logging.error(f"Uncaught exception: {e}")
         logging.error(traceback.format_exc())
-        simple_slack_notification(
+        notification_queue.enqueue_text(
             status_slack_webhook,
             f"🚨🚨 Skip_enabled Miss-check-alert failed! 🚨🚨\nUncaught exception: {e}",
         )
     finally:
+        # Deliver the run's alerts before the upload so the log records the outcome;
+        # undelivered messages stay queued and are retried on the next run
+        notification_worker.stop(timeout=30)
         try:
-            script_dir = Path(__file__).parent
             log_file_path = script_dir / "skip-check-enable-alert.log"
             bucket = os.getenv("AWS_LOG_BUCKET")
             now = datetime.now()
             log_key = f"s3://{bucket}/logs/video-enabled-error-check-{now.strftime('%Y-%m-%d_%H-%M-%S')}.log"
             wr.s3.upload(str(log_file_path), log_key, boto3_session=boto3_session)
             print(f"✅ Log uploaded to {log_key}")
-            simple_slack_notification(
+            profile_artifacts = profiler.artifacts if profiler is not None else []
+            for artifact_path in profile_artifacts:
+                artifact_key = f"{log_key.removesuffix('.log')}-profile/{os.path.basename(artifact_path)}"
+                wr.s3.upload(artifact_path, artifact_key, boto3_session=boto3_session)
+            if profile_artifacts:
+                print(f"✅ Profile uploaded to {log_key.removesuffix('.log')}-profile/")
+            notification_queue.enqueue_text(
                 status_slack_webhook,
                 f"Skip-not-enabled-alert completed!\n✅ Log uploaded to {log_key}",
             )
         except Exception as upload_err:
-            simple_slack_notification(
+            notification_queue.enqueue_text(
                 status_slack_webhook, f"⚠️ Failed to upload log to S3: {upload_err}"
             )
+        notification_worker.flush(timeout=10)
@@ -0,0 +1,369 @@
+"""Durable outbound Slack notification queue.
+
+Messages are written to a local SQLite database instead of being posted
+inline. A background `NotificationWorker` delivers them over a pooled
+session, coalescing pending messages for the same webhook into a single
+post. Failed sends stay in the queue and are retried with exponential
+backoff by the next worker, including one started by a later run, so alerts
+survive Slack outages. A message is only abandoned, with an error logged,
+once it is older than the queue's `max_age`. If Slack rejects a merged post outright (a 4xx other than 429), its messages
+are re-sent one by one so only the bad message is dropped.
+
+Usage example:
+    from notification_queue import NotificationQueue, NotificationWorker
+    queue = NotificationQueue("notification_queue.db")
+    worker = NotificationWorker(queue)
+    worker.start()
+    queue.enqueue(webhook_url, {"blocks": [...]})
+    worker.stop(timeout=30)
+    queue.enqueue_text(status_webhook, "done")
+    worker.flush(timeout=10)
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# Slack rejects messages with more than 50 blocks.
+MAX_BLOCKS_PER_MESSAGE = 50
+
+
+class NotificationQueue:
+    """SQLite-backed queue of pending webhook messages.
+
+    Args:
+        db_path: Path of the SQLite database file (created if missing).
+        lease_seconds: How long a claimed message is hidden from other
+            workers before it is considered abandoned and retried.
+        retry_delay: Seconds before the first retry of a failed message,
+            doubled after every further failure.
+        max_retry_delay: Upper bound on the delay between retries.
+        max_age: Messages still undelivered this many seconds after being
+            queued are abandoned.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        lease_seconds: int = 120,
+        retry_delay: float = 30,
+        max_retry_delay: float = 3600,
+        max_age: float = 2 * 24 * 3600,
+    ):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.max_age = max_age
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    webhook_url TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    claimed_until REAL,
+                    last_error TEXT,
+                    sent_at REAL,
+                    next_attempt_at REAL,
+                    abandoned_at REAL
+                )
+                """
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(messages)")}
+            if "next_attempt_at" not in columns:
+                conn.execute("ALTER TABLE messages ADD COLUMN next_attempt_at REAL")
+            if "abandoned_at" not in columns:
+                conn.execute("ALTER TABLE messages ADD COLUMN abandoned_at REAL")
+                # Older databases marked rejected messages by maxing out attempts.
+                conn.execute(
+                    "UPDATE messages SET abandoned_at = ? WHERE sent_at IS NULL AND attempts >= 20",
+                    (time.time(),),
+                )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+
+    def enqueue(self, webhook_url: str, json_data) -> bool:
+        """Store a message for delivery. Mirrors `slack_notification`'s return."""
+        if not json_data:
+            logger.info("No message to send; skipping Slack notification.")
+            return False
+
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO messages (webhook_url, payload, created_at) VALUES (?, ?, ?)",
+                (webhook_url, json.dumps(json_data), time.time()),
+            )
+        logger.info("Slack notification queued")
+        return True
+
+    def enqueue_text(self, webhook_url: str, msg: str) -> bool:
+        """Queue a plain mrkdwn message, like `simple_slack_notification`."""
+        json_data = {
+            "blocks": [{"type": "section", "text": {"type": "mrkdwn", "text": msg}}]
+        }
+        return self.enqueue(webhook_url, json_data)
+
+    def claim_pending(self) -> list[tuple[int, str, dict]]:
+        """Claim all messages due for delivery, oldest first, for this worker.
+
+        Messages older than `max_age` are abandoned instead of claimed.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            expired = conn.execute(
+                """
+                SELECT id, created_at, attempts, last_error FROM messages
+                WHERE sent_at IS NULL AND abandoned_at IS NULL
+                  AND created_at < ?
+                  AND (claimed_until IS NULL OR claimed_until < ?)
+                """,
+                (now - self.max_age, now),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE messages SET abandoned_at = ? WHERE id = ?",
+                [(now, row[0]) for row in expired],
+            )
+            rows = conn.execute(
+                """
+                SELECT id, webhook_url, payload FROM messages
+                WHERE sent_at IS NULL AND abandoned_at IS NULL
+                  AND (next_attempt_at IS NULL OR next_attempt_at <= ?)
+                  AND (claimed_until IS NULL OR claimed_until < ?)
+                ORDER BY id
+                """,
+                (now, now),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE messages SET claimed_until = ? WHERE id = ?",
+                [(now + self.lease_seconds, row[0]) for row in rows],
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+        for message_id, created_at, attempts, last_error in expired:
+            logger.error(
+                "Abandoning Slack notification %d undelivered after %.1f h and %d attempts: %s",
+                message_id,
+                (now - created_at) / 3600,
+                attempts,
+                last_error,
+            )
+        return [(row[0], row[1], json.loads(row[2])) for row in rows]
+
+    def mark_sent(self, message_ids: list[int]):
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE messages SET sent_at = ?, claimed_until = NULL WHERE id = ?",
+                [(time.time(), i) for i in message_ids],
+            )
+
+    def mark_failed(self, message_ids: list[int], error: str):
+        """Schedule a retry, backing off exponentially with every failure."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                """
+                UPDATE messages
+                SET next_attempt_at = ? + MIN(?, ? * (1 << MIN(attempts, 20))),
+                    attempts = attempts + 1, last_error = ?, claimed_until = NULL
+                WHERE id = ?
+                """,
+                [(now, self.max_retry_delay, self.retry_delay, error, i) for i in message_ids],
+            )
+
+    def mark_rejected(self, message_ids: list[int], error: str):
+        """Mark messages Slack will never accept so they are not retried."""
+        with self._connect() as conn:
+            conn.executemany(
+                """
+                UPDATE messages
+                SET abandoned_at = ?, attempts = attempts + 1, last_error = ?,
+                    claimed_until = NULL
+                WHERE id = ?
+                """,
+                [(time.time(), error, i) for i in message_ids],
+            )
+
+    def pending_count(self) -> int:
+        """Count undelivered messages that will still be retried."""
+        with self._connect() as conn:
+            (count,) = conn.execute(
+                "SELECT COUNT(*) FROM messages WHERE sent_at IS NULL AND abandoned_at IS NULL"
+            ).fetchone()
+        return count
+
+
+def coalesce(messages: list[tuple[int, str, dict]]) -> list[tuple[str, list[int], dict]]:
+    """Merge messages for the same webhook into as few posts as Slack allows.
+
+    Returns:
+        A list of `(webhook_url, message_ids, json_data)` tuples.
+    """
+    batches = []
+    current = {}
+    for message_id, webhook_url, json_data in messages:
+        blocks = json_data.get("blocks")
+        if not blocks:
+            # Not a blocks message; deliver it on its own.
+            batches.append((webhook_url, [message_id], json_data))
+            continue
+
+        batch = current.get(webhook_url)
+        if batch and len(batch[2]["blocks"]) + len(blocks) + 1 > MAX_BLOCKS_PER_MESSAGE:
+            batches.append(batch)
+            batch = None
+        if batch is None:
+            batch = (webhook_url, [], {"blocks": []})
+            current[webhook_url] = batch
+        else:
+            batch[2]["blocks"].append({"type": "divider"})
+
+        batch[1].append(message_id)
+        batch[2]["blocks"].extend(blocks)
+
+    batches.extend(current.values())
+    return batches
+
+
+class NotificationWorker:
+    """Background thread delivering queued messages.
+
+    Args:
+        queue: The `NotificationQueue` to drain.
+        interval: Seconds between delivery passes.
+        max_retries: Retry attempts per post for transient HTTP errors.
+        session: Optional pre-configured requests.Session (useful for testing).
+    """
+
+    def __init__(
+        self,
+        queue: NotificationQueue,
+        interval: float = 2,
+        max_retries: int = 3,
+        session: Optional[requests.Session] = None,
+    ):
+        self.queue = queue
+        self.interval = interval
+        self.session = session or self._create_session(max_retries)
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _create_session(self, max_retries: int) -> requests.Session:
+        """Create requests session with retry strategy for transient errors."""
+        session = requests.Session()
+        retry_strategy = Retry(
+            total=max_retries,
+            backoff_factor=1,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["POST"],
+        )
+        adapter = HTTPAdapter(max_retries=retry_strategy)
+        session.mount("https://", adapter)
+        return session
+
+    def _post(self, webhook_url: str, json_data: dict) -> Optional[tuple[str, bool]]:
+        """Post one message. Returns None on success, else `(error, permanent)`."""
+        try:
+            response = self.session.post(webhook_url, json=json_data, timeout=10)
+            response.raise_for_status()
+        except requests.exceptions.HTTPError as e:
+            status = e.response.status_code
+            return repr(e), 400 <= status < 500 and status != 429
+        except requests.exceptions.RequestException as e:
+            return repr(e), False
+        return None
+
+    def deliver_pending(self) -> int:
+        """Run one delivery pass. Returns the number of messages delivered."""
+        delivered = 0
+        pending = self.queue.claim_pending()
+        payloads = {message_id: json_data for message_id, _, json_data in pending}
+
+        for webhook_url, message_ids, json_data in coalesce(pending):
+            failure = self._post(webhook_url, json_data)
+            if failure is None:
+                self.queue.mark_sent(message_ids)
+                delivered += len(message_ids)
+                logger.info("Slack alert sent successfully (%d queued messages)", len(message_ids))
+                continue
+
+            error, permanent = failure
+            if not permanent:
+                logger.error("Failed to send alert to Slack: %s", error)
+                self.queue.mark_failed(message_ids, error)
+                continue
+            if len(message_ids) == 1:
+                logger.error("Slack rejected alert, not retrying: %s", error)
+                self.queue.mark_rejected(message_ids, error)
+                continue
+
+            # One of the merged messages is bad; find it by sending them separately.
+            logger.info("Slack rejected merged post, sending %d messages separately", len(message_ids))
+            for message_id in message_ids:
+                failure = self._post(webhook_url, payloads[message_id])
+                if failure is None:
+                    self.queue.mark_sent([message_id])
+                    delivered += 1
+                elif failure[1]:
+                    logger.error("Slack rejected alert, not retrying: %s", failure[0])
+                    self.queue.mark_rejected([message_id], failure[0])
+                else:
+                    logger.error("Failed to send alert to Slack: %s", failure[0])
+                    self.queue.mark_failed([message_id], failure[0])
+
+        return delivered
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.deliver_pending()
+            except Exception:
+                logger.exception("Notification delivery pass failed")
+            self._stop_event.wait(self.interval)
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="notification-worker", daemon=True
+        )
+        self._thread.start()
+
+    def flush(self, timeout: float = 10):
+        """Run one delivery pass now, waiting at most `timeout` for it."""
+        flusher = threading.Thread(target=self.deliver_pending, daemon=True)
+        flusher.start()
+        flusher.join(timeout)
+
+    def stop(self, timeout: float = 30):
+        """Stop the worker after a final delivery pass, waiting at most `timeout`.
+
+        Anything not delivered in time stays queued for the next run.
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+        self.flush(timeout)
+        pending = self.queue.pending_count()
+        if pending:
+            logger.warning("%d Slack notifications left queued for the next run", pending)
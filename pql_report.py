@@ -0,0 +1,384 @@
+"""Synchronous PQL entity queries as a low-latency alternative to report jobs.
+
+The skip-not-enabled rule only needs creative duration, skippability, size,
+deal ID and end date, all of which live on GAM entities. Instead of queueing
+a report job, `PQLReportClient` pulls LineItem, LineItemCreativeAssociation,
+Creative, Order and User entities with paged PQL statements, fetching the
+pages of each statement concurrently. Creatives, orders and users change
+rarely, so they are cached locally as JSON and only re-fetched when GAM
+reports a newer `lastModifiedDateTime`.
+
+The result has the same normalized columns as `GAMReportClient.fetch_report_df`
+for the saved skip-not-enabled query. `video_viewership_skip_button_shown` is
+a 0/1 flag derived from the skippable settings rather than an impression
+count, which is all the rule compares against.
+
+Usage example:
+    from pql_report import PQLReportClient
+    pql = PQLReportClient(ad_manager_client, cache_dir="/tmp/gam-entity-cache")
+    df = pql.fetch_skip_check_df(datetime.now(pytz.utc))
+"""
+
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Optional
+
+import pandas as pd
+import pytz
+from googleads import ad_manager
+from zeep.helpers import serialize_object
+
+from retry_logic import retry
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = ad_manager.SUGGESTED_PAGE_LIMIT
+# Max IDs inlined into a single `IN (...)` clause.
+ID_CHUNK_SIZE = 400
+# Allowance for clock skew between this host and GAM when syncing the cache.
+SYNC_SKEW = timedelta(minutes=5)
+SKIPPABLE_TYPES = {"ENABLED", "INSTREAM_SELECT", "ANY"}
+COLUMNS = [
+    "line_item_name",
+    "creative_name",
+    "creative_size",
+    "programmatic_deal_id",
+    "order_name",
+    "line_item_id",
+    "creative_id",
+    "order_id",
+    "order_trafficker",
+    "video_viewership_video_length",
+    "video_viewership_skip_button_shown",
+    "line_item_creative_end_date",
+]
+
+
+def _chunks(ids: list[int], size: int = ID_CHUNK_SIZE):
+    for start in range(0, len(ids), size):
+        yield ids[start : start + size]
+
+
+def _in_clause(ids: list[int]) -> str:
+    return ", ".join(str(int(i)) for i in ids)
+
+
+def _to_timestamp(date_time: Optional[dict]) -> Optional[str]:
+    """Convert a GAM `DateTime` into an ISO-8601 string."""
+    if not date_time:
+        return None
+    date = date_time["date"]
+    local = datetime(
+        date["year"],
+        date["month"],
+        date["day"],
+        date_time["hour"],
+        date_time["minute"],
+        date_time["second"],
+    )
+    return pytz.timezone(date_time["timeZoneId"]).localize(local).isoformat()
+
+
+class PQLReportClient:
+    """Builds the skip-check DataFrame from GAM entities instead of a report.
+
+    Args:
+        ad_manager_client: An authenticated `googleads.ad_manager.AdManagerClient`.
+        version: API version string (default "v202508").
+        cache_dir: Directory for the local creative/order/user cache.
+        max_workers: Max concurrent page fetches.
+    """
+
+    def __init__(
+        self,
+        ad_manager_client: ad_manager.AdManagerClient,
+        version: str = "v202508",
+        cache_dir: Optional[str] = None,
+        max_workers: int = 4,
+    ) -> None:
+        self.ad_manager_client = ad_manager_client
+        self.version = version
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+        self._local = threading.local()
+
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+
+    def _service(self, service_name: str):
+        # googleads services are not thread safe, so keep one per thread.
+        services = self._local.__dict__.setdefault("services", {})
+        if service_name not in services:
+            services[service_name] = self.ad_manager_client.GetService(
+                service_name, version=self.version
+            )
+        return services[service_name]
+
+    @retry(retries=3, delay=5)
+    def _fetch_page(
+        self, service_name: str, method_name: str, where: str, bind_variables: dict, offset: int
+    ):
+        statement = (
+            ad_manager.StatementBuilder(version=self.version)
+            .Where(where)
+            .Limit(PAGE_SIZE)
+            .Offset(offset)
+        )
+        for key, value in bind_variables.items():
+            statement = statement.WithBindVariable(key, value)
+
+        service = self._service(service_name)
+        return getattr(service, method_name)(statement.ToStatement())
+
+    def _fetch_pages(self, service_name: str, method_name: str, page_requests: list[tuple]) -> list:
+        """Fetch `(where, bind_variables, offset)` pages on one shared pool."""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pages = list(
+                executor.map(
+                    lambda request: self._fetch_page(service_name, method_name, *request),
+                    page_requests,
+                )
+            )
+
+        # `retry` returns None once it gives up; a missing page would silently drop entities.
+        if any(page is None for page in pages):
+            raise RuntimeError(f"{service_name}.{method_name} failed after retries")
+        return pages
+
+    def fetch_statements(
+        self, service_name: str, method_name: str, statements: list[tuple[str, dict]]
+    ) -> list[dict]:
+        """Fetch every entity matching any of `statements`, pages in parallel.
+
+        The first page of every statement is requested concurrently; each
+        gives its `totalResultSetSize`, and all remaining pages are then
+        requested concurrently too. Both rounds share one pool, so at most
+        `max_workers` calls are in flight.
+
+        Args:
+            statements: `(where, bind_variables)` pairs.
+
+        Returns:
+            The matching entities as plain dicts.
+        """
+        first_pages = self._fetch_pages(
+            service_name,
+            method_name,
+            [(where, bind_variables, 0) for where, bind_variables in statements],
+        )
+        rest = [
+            (where, bind_variables, offset)
+            for (where, bind_variables), first in zip(statements, first_pages)
+            for offset in range(PAGE_SIZE, first["totalResultSetSize"], PAGE_SIZE)
+        ]
+        pages = first_pages + self._fetch_pages(service_name, method_name, rest)
+
+        return [
+            serialize_object(entity, dict)
+            for page in pages
+            if "results" in page and page["results"]
+            for entity in page["results"]
+        ]
+
+    def fetch_all(
+        self,
+        service_name: str,
+        method_name: str,
+        where: str,
+        bind_variables: Optional[dict] = None,
+    ) -> list[dict]:
+        """Fetch every entity matching `where` (see `fetch_statements`)."""
+        return self.fetch_statements(
+            service_name, method_name, [(where, bind_variables or {})]
+        )
+
+    def fetch_by_ids(
+        self,
+        service_name: str,
+        method_name: str,
+        ids: list[int],
+        where: str = "",
+        bind_variables: Optional[dict] = None,
+        id_field: str = "id",
+    ) -> list[dict]:
+        """Fetch entities whose `id_field` is in `ids`, one statement per chunk."""
+        extra = f" AND {where}" if where else ""
+        statements = [
+            (f"{id_field} IN ({_in_clause(chunk)}){extra}", bind_variables or {})
+            for chunk in _chunks(sorted(set(ids)))
+        ]
+        return self.fetch_statements(service_name, method_name, statements)
+
+    def _cache_path(self, name: str) -> str:
+        return os.path.join(self.cache_dir, f"{name}.json")
+
+    def _load_cache(self, name: str) -> dict:
+        empty = {"synced_at": None, "entities": {}}
+        if not self.cache_dir:
+            return empty
+        try:
+            with open(self._cache_path(name), "r") as f:
+                cache = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return empty
+
+        return {
+            # googleads needs a pytz zone to build a bind variable from it
+            "synced_at": datetime.fromisoformat(cache["synced_at"]).astimezone(pytz.utc),
+            "entities": {int(i): entity for i, entity in cache["entities"].items()},
+        }
+
+    def _save_cache(self, name: str, cache: dict):
+        if not self.cache_dir:
+            return
+        path = self._cache_path(name)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "synced_at": cache["synced_at"].isoformat(),
+                    "entities": cache["entities"],
+                },
+                f,
+                default=str,
+            )
+        os.replace(tmp_path, path)
+
+    def fetch_cached(
+        self,
+        name: str,
+        service_name: str,
+        method_name: str,
+        ids: list[int],
+        track_modified: bool = True,
+    ) -> dict[int, dict]:
+        """Return entities by ID, only re-fetching ones that may have changed.
+
+        Uncached IDs are fetched in full. Cached IDs are re-queried with a
+        `lastModifiedDateTime` filter, so unchanged entities cost nothing
+        beyond an empty page. Entities without `lastModifiedDateTime`
+        (`track_modified=False`, e.g. users) are only fetched once.
+        """
+        cache = self._load_cache(name)
+        entities = cache["entities"]
+        now = datetime.now(pytz.utc)
+
+        missing = [i for i in set(ids) if i not in entities]
+        cached = [i for i in set(ids) if i in entities]
+        fetched = self.fetch_by_ids(service_name, method_name, missing)
+        if track_modified and cached and cache["synced_at"]:
+            fetched += self.fetch_by_ids(
+                service_name,
+                method_name,
+                cached,
+                "lastModifiedDateTime >= :since",
+                {"since": cache["synced_at"] - SYNC_SKEW},
+            )
+
+        for entity in fetched:
+            entities[int(entity["id"])] = entity
+        logger.info(
+            "%s: %d requested, %d fetched, %d served from cache",
+            name,
+            len(set(ids)),
+            len(fetched),
+            len(set(ids)) - len(fetched),
+        )
+
+        cache["synced_at"] = now
+        self._save_cache(name, cache)
+        return {i: entities[i] for i in set(ids) if i in entities}
+
+    def fetch_skip_check_df(self, end_after: datetime) -> pd.DataFrame:
+        """Build the skip-check DataFrame for line items ending after `end_after`.
+
+        Args:
+            end_after: Timezone-aware datetime; line items that ended earlier
+                can never violate the rule and are not fetched.
+
+        Returns:
+            A DataFrame with the same normalized columns as the saved report.
+        """
+        line_items = self.fetch_all(
+            "LineItemService",
+            "getLineItemsByStatement",
+            "endDateTime >= :end_after",
+            {"end_after": end_after},
+        )
+        line_items = [li for li in line_items if not li.get("isArchived")]
+        line_items_by_id = {int(li["id"]): li for li in line_items}
+
+        licas = self.fetch_by_ids(
+            "LineItemCreativeAssociationService",
+            "getLineItemCreativeAssociationsByStatement",
+            list(line_items_by_id),
+            # Inactive associations do not serve, and deactivating is the usual fix
+            "status = 'ACTIVE'",
+            id_field="lineItemId",
+        )
+
+        creatives = self.fetch_cached(
+            "creatives",
+            "CreativeService",
+            "getCreativesByStatement",
+            [int(lica["creativeId"]) for lica in licas],
+        )
+        orders = self.fetch_cached(
+            "orders",
+            "OrderService",
+            "getOrdersByStatement",
+            [int(li["orderId"]) for li in line_items],
+        )
+        users = self.fetch_cached(
+            "users",
+            "UserService",
+            "getUsersByStatement",
+            [int(order["traffickerId"]) for order in orders.values() if order.get("traffickerId")],
+            track_modified=False,
+        )
+
+        rows = []
+        for lica in licas:
+            line_item = line_items_by_id[int(lica["lineItemId"])]
+            creative = creatives.get(int(lica["creativeId"]), {})
+            order = orders.get(int(line_item["orderId"]), {})
+            trafficker = users.get(int(order.get("traffickerId") or 0), {})
+
+            size = creative.get("size") or {}
+            is_video = creative.get("duration") is not None
+            skippable = (
+                creative.get("skippableAdType") in SKIPPABLE_TYPES
+                or line_item.get("skippableAdType") in SKIPPABLE_TYPES
+            )
+            deal_info = line_item.get("dealInfo") or {}
+
+            rows.append(
+                {
+                    "line_item_name": line_item["name"],
+                    "creative_name": creative.get("name"),
+                    "creative_size": f"{size.get('width')} x {size.get('height')}"
+                    + ("v" if is_video else ""),
+                    "programmatic_deal_id": deal_info.get("externalDealId") or 0,
+                    "order_name": order.get("name"),
+                    "line_item_id": int(line_item["id"]),
+                    "creative_id": int(lica["creativeId"]),
+                    "order_id": int(line_item["orderId"]),
+                    "order_trafficker": f"{trafficker.get('name')} ({trafficker.get('email')})",
+                    "video_viewership_video_length": (creative.get("duration") or 0) / 1000,
+                    "video_viewership_skip_button_shown": int(skippable),
+                    "line_item_creative_end_date": _to_timestamp(
+                        lica.get("endDateTime") or line_item.get("endDateTime")
+                    ),
+                }
+            )
+
+        logger.info(
+            "Built skip-check data from entities: %d line items, %d associations",
+            len(line_items),
+            len(rows),
+        )
+        return pd.DataFrame(rows, columns=COLUMNS)
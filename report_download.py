@@ -0,0 +1,159 @@
+"""Streaming download of GAM report files.
+
+The signed GCS URL returned by `getReportDownloadUrlWithOptions` is streamed
+to a local spool file over a pooled `requests.Session`. Interrupted transfers
+are resumed with an HTTP `Range` request instead of starting over, and the
+finished file is checked against the `Content-Length` and, when GCS provides
+one, the MD5 from the `x-goog-hash` header.
+
+Usage example:
+    from report_download import download_report, read_report_csv
+    path = download_report(url, "/tmp/report.csv.gz")
+    df = read_report_csv(path)
+"""
+
+import base64
+import gzip
+import hashlib
+import logging
+import time
+from typing import Optional
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class ReportDownloadError(Exception):
+    """Raised when a report cannot be downloaded completely and intact."""
+
+
+def _create_session() -> requests.Session:
+    """Create a session that reuses connections to the GCS host."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4)
+    session.mount("https://", adapter)
+    return session
+
+
+_session: Optional[requests.Session] = None
+
+
+def get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        _session = _create_session()
+    return _session
+
+
+def _expected_md5(response: requests.Response) -> Optional[str]:
+    # GCS sends e.g. "x-goog-hash: crc32c=n03x6A==,md5=Ojk9c3dhfxgoKVVHYwFbHQ=="
+    for part in response.headers.get("x-goog-hash", "").split(","):
+        name, _, value = part.strip().partition("=")
+        if name == "md5":
+            return base64.b64decode(value).hex()
+    return None
+
+
+def download_report(
+    url: str,
+    dest_path: str,
+    retries: int = 5,
+    delay: float = 5,
+    timeout: tuple[float, float] = (10, 60),
+    session: Optional[requests.Session] = None,
+) -> str:
+    """Stream `url` to `dest_path`, resuming with HTTP Range after failures.
+
+    Args:
+        url: Report download URL.
+        dest_path: Local spool file to write the (still compressed) report to.
+        retries: Max attempts before giving up. Timeouts, connection
+            errors and 5xx, 408 and 429 responses are retried.
+        delay: Base delay in seconds between attempts, doubled each retry.
+        timeout: `(connect, read)` timeout passed to `requests`.
+        session: Optional pre-configured session (defaults to a shared pool).
+
+    Returns:
+        `dest_path` once the file is complete and verified.
+
+    Raises:
+        ReportDownloadError: If the download fails `retries` times, is
+            rejected with a 4xx other than 408/429 (not retried), or the
+            finished file does not match the expected length or checksum.
+    """
+    session = session or get_session()
+    md5 = hashlib.md5()
+    written = 0
+    total_size = None
+    expected_md5 = None
+
+    with open(dest_path, "wb") as f:
+        for i in range(1, retries + 1):
+            headers = {"Range": f"bytes={written}-"} if written else {}
+            try:
+                logger.info("Downloading report (%d): offset=%d", i, written)
+                with session.get(
+                    url, headers=headers, stream=True, timeout=timeout
+                ) as response:
+                    response.raise_for_status()
+                    if written and response.status_code != 206:
+                        # Server ignored the Range header; start from scratch.
+                        logger.info("Range not honoured, restarting download")
+                        f.seek(0)
+                        f.truncate()
+                        md5 = hashlib.md5()
+                        written = 0
+                    if total_size is None:
+                        total_size = written + int(
+                            response.headers.get("Content-Length", 0)
+                        ) or None
+                        expected_md5 = _expected_md5(response)
+
+                    # Keep the bytes exactly as stored so Range offsets line up.
+                    for chunk in response.raw.stream(CHUNK_SIZE, decode_content=False):
+                        f.write(chunk)
+                        md5.update(chunk)
+                        written += len(chunk)
+                if total_size is None or written >= total_size:
+                    break
+                logger.info(
+                    "Connection closed early at %d of %d bytes", written, total_size
+                )
+            except (requests.exceptions.RequestException, HTTPError) as e:
+                status = e.response.status_code if getattr(e, "response", None) is not None else None
+                if status is not None and 400 <= status < 500 and status not in (408, 429):
+                    # e.g. 403 for an expired signed URL; retrying cannot help
+                    raise ReportDownloadError(f"Report download rejected: {e!r}") from e
+                if i == retries:
+                    raise ReportDownloadError(
+                        f"Report download failed after {retries} attempts: {e!r}"
+                    ) from e
+                logger.info("Error: %r -> Retrying download...", e)
+                time.sleep(delay * 2 ** (i - 1))
+
+    if total_size is not None and written != total_size:
+        raise ReportDownloadError(
+            f"Report download incomplete: got {written} of {total_size} bytes"
+        )
+    if expected_md5 is not None and md5.hexdigest() != expected_md5:
+        raise ReportDownloadError("Report download checksum mismatch")
+
+    logger.info("Report downloaded to %s (%d bytes)", dest_path, written)
+    return dest_path
+
+
+def read_report_csv(path: str) -> pd.DataFrame:
+    """Parse a gzipped report CSV, decompressing incrementally as it is read."""
+    with open(path, "rb") as raw:
+        is_gzip = raw.read(2) == b"\x1f\x8b"
+
+    opener = gzip.open if is_gzip else open
+    with opener(path, "rb") as f:
+        return pd.read_csv(f, low_memory=False)
+
@@ -0,0 +1,119 @@
+"""Cross-process registry of in-flight GAM report jobs.
+
+Overlapping runs (cron overlap, a manual rerun next to a scheduled one) used
+to each submit their own `runReportJob` for the same saved query. The
+registry is a small JSON file guarded by an exclusive file lock: the first
+process to ask for a query records the job it submitted, and any process
+asking for the same query hash while that job is still running attaches to
+its job ID instead of submitting a duplicate. Entries are discarded as soon
+as the job finishes, so the registry never serves stale results.
+
+Usage example:
+    from report_job_registry import ReportJobRegistry
+    registry = ReportJobRegistry("/tmp/gam-report-jobs")
+    job_id = registry.get_or_submit(query_hash, lambda: submit()["id"])
+"""
+
+import fcntl
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ReportJobRegistry:
+    """File-lock-based registry of report jobs keyed by query hash.
+
+    Args:
+        registry_dir: Directory holding the registry and lock files.
+        max_age: Seconds after which an entry is ignored even if never
+            discarded, e.g. because its owner crashed mid-poll.
+    """
+
+    def __init__(self, registry_dir: str, max_age: int = 900):
+        os.makedirs(registry_dir, exist_ok=True)
+        self.registry_path = os.path.join(registry_dir, "report_jobs.json")
+        self.lock_path = os.path.join(registry_dir, "report_jobs.lock")
+        self.max_age = max_age
+
+    @contextmanager
+    def _locked(self):
+        with open(self.lock_path, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self) -> dict:
+        try:
+            with open(self.registry_path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write(self, jobs: dict):
+        now = time.time()
+        jobs = {
+            key: job for key, job in jobs.items() if now - job["submitted_at"] < self.max_age
+        }
+        tmp_path = f"{self.registry_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(jobs, f)
+        os.replace(tmp_path, self.registry_path)
+
+    def get_or_submit(
+        self,
+        query_hash: str,
+        submit: Callable[[], int],
+        is_in_flight: Optional[Callable[[int], bool]] = None,
+    ) -> int:
+        """Return the in-flight job for `query_hash`, submitting one if needed.
+
+        The lock is held while `submit` runs so two processes can never both
+        submit the same query.
+
+        Args:
+            query_hash: Stable hash of the report query.
+            submit: Submits the report job and returns its ID.
+            is_in_flight: Optional check that a registered job is still
+                running; finished jobs are dropped rather than attached to.
+
+        Returns:
+            The report job ID to poll and download.
+        """
+        with self._locked():
+            jobs = self._read()
+            job = jobs.get(query_hash)
+            if (
+                job
+                and time.time() - job["submitted_at"] < self.max_age
+                and (is_in_flight is None or is_in_flight(job["job_id"]))
+            ):
+                logger.info(
+                    "Attaching to in-flight report job %s (submitted by pid %s)",
+                    job["job_id"],
+                    job["pid"],
+                )
+                return job["job_id"]
+
+            job_id = int(submit())
+            jobs[query_hash] = {
+                "job_id": job_id,
+                "pid": os.getpid(),
+                "submitted_at": time.time(),
+            }
+            self._write(jobs)
+
+        return job_id
+
+    def discard(self, job_id: int):
+        """Forget a job (e.g. one that failed) so the next caller resubmits."""
+        with self._locked():
+            jobs = self._read()
+            jobs = {key: job for key, job in jobs.items() if job["job_id"] != job_id}
+            self._write(jobs)
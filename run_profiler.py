@@ -0,0 +1,111 @@
+"""Opt-in per-stage profiling for production runs.
+
+When enabled, each pipeline stage wrapped in `RunProfiler.stage` is run
+under cProfile and bracketed by tracemalloc snapshots. Every stage writes a
+`<stage>.prof` file (open with `snakeviz` or `pstats`) and a
+`<stage>_alloc.txt` report of the top allocations made during the stage.
+When disabled, `stage` is a no-op.
+
+cProfile only records the thread that enabled it, so threads started during
+a stage (the `ThreadPoolExecutor` workers of the sharded and PQL fetch paths)
+get their own profiler through `threading.setprofile`, and their stats are
+merged into the stage's `.prof` file. Where the interpreter allows only one
+active cProfile (Python 3.12+), worker threads are left unprofiled and the
+stage file shows the main thread waiting on them.
+
+Usage example:
+    from run_profiler import RunProfiler
+    profiler = RunProfiler("/tmp/profile", enabled=True)
+    with profiler.stage("fetch_report_df"):
+        df = client.fetch_report_df(job_id)
+    profiler.artifacts  # paths to upload
+"""
+
+import cProfile
+import logging
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class RunProfiler:
+    """Collects cProfile and tracemalloc artifacts per pipeline stage.
+
+    Args:
+        output_dir: Directory the artifacts are written to.
+        enabled: When False, stages run without any profiling overhead.
+        top_n: Number of allocation sites listed in each report.
+    """
+
+    def __init__(self, output_dir: str, enabled: bool = False, top_n: int = 25):
+        self.output_dir = output_dir
+        self.enabled = enabled
+        self.top_n = top_n
+        self.artifacts: list[str] = []
+
+        if self.enabled:
+            os.makedirs(self.output_dir, exist_ok=True)
+            tracemalloc.start()
+            logger.info("Profiling enabled, writing artifacts to %s", self.output_dir)
+
+    @contextmanager
+    def stage(self, name: str):
+        if not self.enabled:
+            yield
+            return
+
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        thread_profiles = []
+        lock = threading.Lock()
+
+        def start_thread_profile(frame, event, arg):
+            # Runs on the first event of each thread started during the stage.
+            thread_profile = cProfile.Profile()
+            try:
+                thread_profile.enable()
+            except ValueError:
+                sys.setprofile(None)
+                return
+            with lock:
+                thread_profiles.append(thread_profile)
+
+        profile = cProfile.Profile()
+        threading.setprofile(start_thread_profile)
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            threading.setprofile(None)
+            stats = pstats.Stats(profile)
+            for thread_profile in thread_profiles:
+                stats.add(thread_profile)
+            after = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            self._write_stage(name, stats, len(thread_profiles), before, after, peak)
+
+    def _write_stage(self, name, stats, thread_count, before, after, peak):
+        prof_path = os.path.join(self.output_dir, f"{name}.prof")
+        stats.dump_stats(prof_path)
+
+        alloc_path = os.path.join(self.output_dir, f"{name}_alloc.txt")
+        stats = after.compare_to(before, "lineno")
+        with open(alloc_path, "w") as f:
+            f.write(f"Stage: {name}\n")
+            f.write(f"Peak traced memory: {peak / 1024 / 1024:.1f} MiB\n\n")
+            for stat in stats[: self.top_n]:
+                f.write(f"{stat}\n")
+
+        self.artifacts.extend([prof_path, alloc_path])
+        logger.info(
+            "Profiled stage %s (%d worker threads, peak %.1f MiB)",
+            name,
+            thread_count,
+            peak / 1024 / 1024,
+        )
@@ -0,0 +1,134 @@
+"""Arrow IPC report snapshots shared between sibling checks on one host.
+
+The skip-not-enabled, geo and VAST-error checks all work from very similar
+report data. Instead of each downloading and parsing its own copy, the first
+check writes its normalized DataFrame as an uncompressed Arrow IPC file in a
+shared directory. Siblings memory-map the file, so the column buffers are
+read straight from the page cache and shared between processes instead of
+being copied into each one.
+
+The file is written to a temporary name and renamed into place, so readers
+never see a partial file. A `created_at` stamp in the schema metadata lets
+readers reject snapshots that are too old, or that were written before the
+reader's own run started and so may predate fixes made since.
+
+Usage example:
+    from shared_report import write_shared_report, read_shared_report
+    write_shared_report(df, "/dev/shm/gam-reports/report_123.arrow")
+    df = read_shared_report(path, columns=["line_item_id"], written_after=run_started_at)
+"""
+
+import logging
+import os
+import time
+from typing import Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+logger = logging.getLogger(__name__)
+
+CREATED_AT_KEY = b"created_at"
+
+
+def write_shared_report(df: pd.DataFrame, path: str) -> bool:
+    """Write `df` as an uncompressed Arrow IPC file at `path`.
+
+    Returns:
+        True if the snapshot was written, False if `df` could not be
+        converted to Arrow (the caller just carries on without sharing).
+    """
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+        logger.warning("Report not shared, cannot convert to Arrow: %s", e)
+        return False
+
+    metadata = dict(table.schema.metadata or {})
+    metadata[CREATED_AT_KEY] = str(time.time()).encode()
+    table = table.replace_schema_metadata(metadata)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    # No compression: compressed buffers would have to be copied out to be read.
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+    logger.info("Shared report written to %s (%d rows)", path, table.num_rows)
+    return True
+
+
+def read_shared_report_table(
+    path: str,
+    columns: Optional[list[str]] = None,
+    max_age: Optional[float] = None,
+    written_after: Optional[float] = None,
+) -> Optional[pa.Table]:
+    """Memory-map a shared report and return it as an Arrow table.
+
+    Args:
+        path: Path written by `write_shared_report`.
+        columns: Optional subset of columns to select.
+        max_age: Max snapshot age in seconds; older snapshots are ignored.
+        written_after: Unix time; snapshots written earlier are ignored.
+
+    Returns:
+        The (zero-copy) table, or None if the snapshot is missing or stale.
+    """
+    try:
+        source = pa.memory_map(path, "r")
+    except FileNotFoundError:
+        logger.info("No shared report at %s", path)
+        return None
+
+    table = ipc.open_file(source).read_all()
+    created_at = float((table.schema.metadata or {}).get(CREATED_AT_KEY, b"0"))
+    age = time.time() - created_at
+    if max_age is not None and age > max_age:
+        logger.info("Shared report at %s is stale (%.0fs old)", path, age)
+        return None
+    if written_after is not None and created_at < written_after:
+        logger.info("Shared report at %s was written before this run started", path)
+        return None
+
+    if columns is not None:
+        table = table.select(columns)
+
+    logger.info("Using shared report %s (%.0fs old, %d rows)", path, age, table.num_rows)
+    return table
+
+
+def read_shared_report(
+    path: str,
+    columns: Optional[list[str]] = None,
+    max_age: Optional[float] = None,
+    written_after: Optional[float] = None,
+    writable: bool = False,
+) -> Optional[pd.DataFrame]:
+    """Like `read_shared_report_table`, converted to a pandas DataFrame.
+
+    By default numeric columns without nulls are views on the memory-mapped
+    file and are READ-ONLY: adding or replacing whole columns works, but
+    in-place edits such as `df.loc[0, "line_item_id"] = 5` raise
+    `ValueError: assignment destination is read-only`. Pass `writable=True`
+    to get a private copy that can be edited freely.
+
+    Args:
+        path: Path written by `write_shared_report`.
+        columns: Optional subset of columns to select.
+        max_age: Max snapshot age in seconds; older snapshots are ignored.
+        written_after: Unix time; snapshots written earlier are ignored.
+        writable: Copy the data out of the mapped file instead of sharing it.
+    """
+    table = read_shared_report_table(path, columns, max_age, written_after)
+    if table is None:
+        return None
+
+    if writable:
+        return table.to_pandas()
+
+    # split_blocks lets single-chunk numeric columns stay views on the mapped file
+    return table.to_pandas(split_blocks=True)
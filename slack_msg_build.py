@@ -78,3 +78,29 @@ def inner_info_block(grouped_df: pd.DataFrame):
         "border": 0,
         "elements": elements,
     }
+
+
+def resolved_info_block(resolved_df: pd.DataFrame):
+    elements = []
+    network_code = get_env("NETWORK_CODE")
+    for j in resolved_df.sort_values("line_item_id", ascending=False).itertuples():
+        elements.append(
+            {
+                "type": "rich_text_section",
+                "elements": [
+                    {
+                        "type": "link",
+                        "url": f"https://admanager.google.com/{network_code}#delivery/line_item/detail/line_item_id={j.line_item_id}&li_tab=settings",
+                        "text": name_shortner(f"{j.line_item_name} | {j.creative_size}"),
+                    },
+                ],
+            },
+        )
+
+    return {
+        "type": "rich_text_list",
+        "style": "bullet",
+        "indent": 0,
+        "border": 0,
+        "elements": elements,
+    }
@@ -0,0 +1,164 @@
+"""Incremental rule evaluation against a snapshot of the previous run.
+
+Every evaluated report row is stored with a hash of its content, keyed by
+line item / creative name / creative size. On the next run only rows whose
+hash changed (or which are new) are passed to the rule; unchanged rows reuse
+the cached result. Comparing the old and new violating keys yields the
+`new`, `persisting` and `resolved` sets.
+
+The cached `rule_violation` is the rule result alone. Date gates such as
+"the line item has not ended" change without the row changing, so callers
+apply them on every run with `apply_end_gate`, which sets `is_ended` and
+the gated `is_violation`.
+
+Usage example:
+    from violation_snapshot import load_snapshot, evaluate_incremental, diff_violations
+    previous = load_snapshot(path, boto3_session)
+    current = evaluate_incremental(delivery_df, previous, rule_func)
+    apply_end_gate(current, is_ended)
+    diff = diff_violations(previous, build_snapshot(current))
+"""
+
+import logging
+from typing import Callable
+
+import pandas as pd
+import awswrangler as wr
+
+logger = logging.getLogger(__name__)
+
+KEY_COLUMNS = ["line_item_id", "creative_name", "creative_size"]
+SNAPSHOT_COLUMNS = KEY_COLUMNS + ["row_hash", "rule_violation", "is_ended", "is_violation"]
+
+
+def _normalize_keys(df: pd.DataFrame) -> pd.DataFrame:
+    for col in KEY_COLUMNS:
+        df[col] = df[col].astype(str).str.strip().str.lower()
+    return df
+
+
+def add_row_hash(df: pd.DataFrame, columns: list[str]) -> pd.DataFrame:
+    """Add a `row_hash` column computed over the raw string values of `columns`.
+
+    Hashing is done on the string form, with missing values blanked, so a row
+    hashes identically whether it came straight from the report CSV, from a
+    shared Arrow snapshot, or was read back from the snapshot.
+    """
+    df["row_hash"] = (
+        pd.util.hash_pandas_object(
+            df[columns].astype(object).fillna("").astype(str), index=False
+        )
+        .astype(str)
+        .values
+    )
+    return df
+
+
+def load_snapshot(snapshot_path: str, boto3_session) -> pd.DataFrame:
+    """Load the previous run's snapshot, or an empty frame if there is none."""
+    try:
+        snapshot_df = wr.s3.read_csv(
+            snapshot_path, boto3_session=boto3_session, dtype=str
+        )
+    except Exception as e:
+        logger.info("No violation snapshot found at %s (%s)", snapshot_path, str(e))
+        return pd.DataFrame(columns=SNAPSHOT_COLUMNS)
+
+    if "rule_violation" not in snapshot_df.columns:
+        # Older snapshots only stored the gated result. It only differs from
+        # the rule result for ended rows, which stay ended unless their end
+        # date (and so their hash) changes.
+        snapshot_df["rule_violation"] = snapshot_df["is_violation"]
+        snapshot_df["is_ended"] = "false"
+    for col in ["rule_violation", "is_ended", "is_violation"]:
+        snapshot_df[col] = snapshot_df[col].str.lower() == "true"
+    logger.info("Loaded violation snapshot with %d rows", len(snapshot_df))
+    return _normalize_keys(snapshot_df[SNAPSHOT_COLUMNS])
+
+
+def save_snapshot(snapshot_df: pd.DataFrame, snapshot_path: str, boto3_session):
+    wr.s3.to_csv(
+        df=snapshot_df[SNAPSHOT_COLUMNS],
+        path=snapshot_path,
+        index=False,
+        boto3_session=boto3_session,
+    )
+    logger.info("Saved violation snapshot with %d rows", len(snapshot_df))
+
+
+def evaluate_incremental(
+    df: pd.DataFrame,
+    previous_df: pd.DataFrame,
+    rule_func: Callable[[pd.DataFrame], pd.Series],
+) -> pd.DataFrame:
+    """Set `rule_violation` on every row of `df`, evaluating only changed rows.
+
+    Args:
+        df: Report rows with key columns and a `row_hash` column.
+        previous_df: Snapshot returned by `load_snapshot`.
+        rule_func: Returns a boolean Series (aligned to its input) that is
+            True for rows violating the rule. Only called on changed rows.
+
+    Returns:
+        `df` with a `rule_violation` column.
+    """
+    lookup = previous_df.drop_duplicates(subset=KEY_COLUMNS + ["row_hash"]).set_index(
+        KEY_COLUMNS + ["row_hash"]
+    )["rule_violation"]
+
+    index = pd.MultiIndex.from_frame(_normalize_keys(df[KEY_COLUMNS + ["row_hash"]].copy()))
+    cached = pd.Series(lookup.reindex(index).values, index=df.index)
+    changed = cached.isna()
+
+    logger.info(
+        "Evaluating %d changed rows, reusing %d cached results",
+        int(changed.sum()),
+        int((~changed).sum()),
+    )
+    df["rule_violation"] = cached
+    if changed.any():
+        df.loc[changed, "rule_violation"] = rule_func(df.loc[changed]).astype(bool)
+    df["rule_violation"] = df["rule_violation"].astype(bool)
+
+    return df
+
+
+def apply_end_gate(df: pd.DataFrame, is_ended: pd.Series) -> pd.DataFrame:
+    """Set `is_ended` and `is_violation` (the rule result for live rows only)."""
+    df["is_ended"] = is_ended.astype(bool)
+    df["is_violation"] = df["rule_violation"] & ~df["is_ended"]
+
+    return df
+
+
+def build_snapshot(df: pd.DataFrame) -> pd.DataFrame:
+    """Reduce evaluated report rows to the columns stored in the snapshot."""
+    snapshot_df = _normalize_keys(df[SNAPSHOT_COLUMNS].copy())
+    return snapshot_df.drop_duplicates(subset=KEY_COLUMNS + ["row_hash"])
+
+
+def _violating_keys(df: pd.DataFrame) -> set:
+    violating = df[df["is_violation"].astype(bool)]
+    return set(zip(*(violating[col] for col in KEY_COLUMNS)))
+
+
+def diff_violations(previous_df: pd.DataFrame, current_df: pd.DataFrame) -> dict:
+    """Compare violating keys between two snapshots.
+
+    Keys that disappeared from the report, or whose rows have all ended, are
+    not reported as resolved: the row being absent or expired says nothing
+    about whether it was fixed.
+
+    Returns:
+        A dict with `new`, `persisting` and `resolved` sets of key tuples.
+    """
+    previous_keys = _violating_keys(previous_df)
+    current_keys = _violating_keys(current_df)
+    live_df = current_df[~current_df["is_ended"].astype(bool)]
+    present_keys = set(zip(*(live_df[col] for col in KEY_COLUMNS)))
+
+    return {
+        "new": current_keys - previous_keys,
+        "persisting": current_keys & previous_keys,
+        "resolved": (previous_keys - current_keys) & present_keys,
+    }